@@ -2,21 +2,69 @@
 
 import argparse
 import os
+import sys
 from pathlib import Path
 from pprint import pprint
+from typing import Iterator
 
 import api
 
+STDIN = "-"
 
-def dir_path(_path):
-    if os.path.isdir(_path):
+
+def manifests_source(_path):
+    """Accepts a manifests directory, a file or pipe (e.g. '<(helm template ...)') or '-' for stdin."""
+    if _path == STDIN:
+        return _path
+    elif os.path.exists(_path):
         return Path(_path)
+    raise argparse.ArgumentTypeError(f"readable_source:{_path} is neither a directory, a file nor '{STDIN}'")
+
+
+def load_manifests(sources):
+    streams = []
+    for source in sources:
+        if source == STDIN:
+            streams.append(sys.stdin)
+        elif source.is_dir():
+            api.create_graph_from_path(source)
+        else:
+            streams.append(open(source, "r"))
+    try:
+        if streams:
+            api.create_graph_from_streams(streams)
+    finally:
+        for stream in streams:
+            if stream is not sys.stdin:
+                stream.close()
+
+
+def print_result(result):
+    # stream lazy results item by item instead of materializing them
+    if isinstance(result, Iterator):
+        for item in result:
+            pprint(item)
     else:
-        raise argparse.ArgumentTypeError(f"readable_dir:{_path} is not a valid path")
+        pprint(result)
 
 
 parser = argparse.ArgumentParser(description="Caboto Kubernetes semantic analysis tool.")
-parser.add_argument("--manifests", "-m", type=dir_path, default=".", help="Path to the manifests directory.")
+parser.add_argument(
+    "--manifests",
+    "-m",
+    type=manifests_source,
+    action="append",
+    help="Path to the manifests directory, a manifests file or pipe, or '-' to read from stdin. Can be given multiple"
+    " times, files, pipes and stdin are read concurrently.",
+)
+parser.add_argument(
+    "--sqlite", "-s", type=Path, help="Store the Caboto graph in this SQLite database file instead of memory."
+)
+parser.add_argument(
+    "--reopen",
+    help="Continue with the graph stored in the --sqlite/-s database instead of replacing it.",
+    action="store_true",
+)
 parser.add_argument("--plot", "-p", help="Plot the graph using matplotlib.", action="store_true")
 parser.add_argument("--exclude", "-e", help="Exclude this entities from plotting")
 parser.add_argument("--run", "-r", help="Run a function from the Caboto API module.")
@@ -27,26 +75,41 @@ parser.add_argument(
     help="Set function arguments comma separated in key-value style (e.g. key:value,key1:value)"
     " and only together with --run/-r",
 )
+parser.add_argument(
+    "--limit", "-l", type=int, help="Output at most this number of results of list_* functions or --query/-q."
+)
+parser.add_argument(
+    "--offset", "-o", type=int, default=0, help="Skip this number of results of list_* functions or --query/-q."
+)
 
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    api.create_graph_from_path(args.manifests)
+    pageable_run = args.run and args.run.startswith("list_") and hasattr(api, args.run.replace("list_", "iter_", 1))
+    if (args.limit is not None or args.offset) and args.run and not pageable_run:
+        parser.error(f"--limit/-l and --offset/-o are not supported by --run/-r {args.run}")
+    if args.reopen and not args.sqlite:
+        parser.error("--reopen requires --sqlite/-s")
+    if args.sqlite:
+        api.create_sqlite_graph(args.sqlite, reopen=args.reopen)
+    if args.manifests or not args.reopen:
+        load_manifests(args.manifests or [Path(".")])
     api.discover_relations()
     print(api.CABOTO_GRAPH)
+    if args.args:
+        _args = {item.split(":")[0]: item.split(":", 1)[1] for item in str(args.args).split(",")}
+    else:
+        _args = {}
     if args.query:
-        if args.args:
-            _args = {item.split(":")[0]: item.split(":", 1)[1] for item in str(args.args).split(",")}
-            pprint(api.exec_query(args.query, **_args))
-        else:
-            pprint(api.exec_query(args.query))
+        print_result(api.iter_query(args.query, limit=args.limit, offset=args.offset, **_args))
     if args.run:
-        func = getattr(api, args.run)
-        if args.args:
-            _args = {item.split(":")[0]: item.split(":", 1)[1] for item in str(args.args).split(",")}
-            pprint(func(**_args))
+        if pageable_run:
+            # list functions are streamed with their lazy iter_ variant
+            func = getattr(api, args.run.replace("list_", "iter_", 1))
+            _args.update(limit=args.limit, offset=args.offset)
         else:
-            pprint(func())
+            func = getattr(api, args.run)
+        print_result(func(**_args))
 
     if args.plot:
         if args.exclude:
@@ -1,13 +1,31 @@
+import sys
+from functools import wraps
+from itertools import islice
 from pathlib import Path
-from typing import List
+from queue import Full, Queue
+from threading import Event, Thread
+from typing import IO, Any, Iterator, List, Tuple, Union
 
 import yaml
+from cache import CacheInfo, GraphResultCache
 from drawing import draw_graph
+from entities import string_table
 from graph import CabotoGraph, K8sData, get_caboto_graph
-from utils import MEMORY_UNITS, get_query, normalize_cpu, normalize_memory_to_bytes, replace_query, run_query
+from relations import ANNOTATION_RULES
+from sqlgraph import SQLiteCabotoGraph
+from utils import MEMORY_UNITS, get_query, normalize_cpu, normalize_memory_to_bytes, replace_query
 
 # the global Caboto graph structure which holds all Kubernetes entities and relations
-CABOTO_GRAPH: CabotoGraph
+CABOTO_GRAPH: Union[CabotoGraph, SQLiteCabotoGraph]
+
+# memoized results of the api functions, bound to the version of the Caboto graph
+RESULT_CACHE = GraphResultCache()
+
+# the number of parsed documents buffered between stream readers and the graph construction
+STREAM_BUFFER_SIZE = 1024
+# seconds a stream reader waits for free space in the buffer before checking whether it should stop
+STREAM_PUT_TIMEOUT = 0.1
+_END_OF_STREAM = object()
 
 
 # decorate api functions with this primer to make sure Caboto graph is loaded
@@ -20,6 +38,39 @@ def caboto_graph_required(func):
     return wrapper
 
 
+# decorate api functions with this primer to memoize their results as long as the Caboto graph does not change
+def caboto_cached(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if isinstance(CABOTO_GRAPH, SQLiteCabotoGraph):
+            # results are not memoized for the SQLite store to keep the memory bounded
+            return func(*args, **kwargs)
+        key = (func.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            # unhashable arguments cannot be cached
+            return func(*args, **kwargs)
+        return RESULT_CACHE.get_or_compute(CABOTO_GRAPH, key, lambda: func(*args, **kwargs))
+
+    return wrapper
+
+
+def cache_info() -> CacheInfo:
+    """Returns the hit and miss statistics of the api result cache."""
+    return RESULT_CACHE.info()
+
+
+def cache_clear() -> None:
+    """Drops all memoized api results and resets the cache statistics."""
+    RESULT_CACHE.clear()
+
+
+def set_cache_size(maxsize: int) -> None:
+    """Sets the maximum number of memoized api results, 0 disables caching."""
+    RESULT_CACHE.resize(int(maxsize))
+
+
 def add_to_caboto(manifests: List[K8sData]) -> None:
     global CABOTO_GRAPH
     if "CABOTO_GRAPH" in globals():
@@ -31,22 +82,89 @@ def add_to_caboto(manifests: List[K8sData]) -> None:
 #
 # Functions to create and manage the Caboto graph
 #
+def create_sqlite_graph(database: Path, reopen: bool = False) -> None:
+    """Stores the Caboto graph in a SQLite database file instead of memory, manifests loaded afterwards are persisted
+    into this database. Use this for graphs that do not fit into memory. A graph already stored in the database is
+    dropped, unless it is reopened to be extended or analysed again."""
+    global CABOTO_GRAPH
+    CABOTO_GRAPH = SQLiteCabotoGraph(database, reopen=reopen)
+    RESULT_CACHE.clear()
+
+
 def create_graph_from_dict(doc: dict) -> None:
     manifest = K8sData(**doc)
     add_to_caboto([manifest])
 
 
-def create_graph_from_string(val: str) -> None:
-    """Loads Kubernetes manifest from yaml formatted string input and constructs a Caboto graph. Extend the graph
-    running this function multiple times."""
+def _load_documents(stream: Union[str, IO]) -> Iterator[dict]:
+    """Parses yaml documents one by one as they arrive in the stream, empty documents are skipped."""
     try:
-        file = yaml.safe_load_all(val)
+        for doc in yaml.safe_load_all(stream):
+            if doc:
+                yield doc
     except yaml.YAMLError as exc:
         print(exc)
         raise exc
-    else:
-        for doc in file:
-            create_graph_from_dict(doc)
+
+
+def _put_document(documents: Queue, item, stop: Event) -> bool:
+    # block on the full queue only until the consumer stops reading
+    while not stop.is_set():
+        try:
+            documents.put(item, timeout=STREAM_PUT_TIMEOUT)
+            return True
+        except Full:
+            continue
+    return False
+
+
+def _read_documents(stream: IO, documents: Queue, stop: Event) -> None:
+    try:
+        for doc in _load_documents(stream):
+            if not _put_document(documents, doc, stop):
+                return
+    except Exception as exc:
+        # any reader failure (yaml, decoding, broken pipes) is raised in the consuming thread
+        _put_document(documents, exc, stop)
+    finally:
+        _put_document(documents, _END_OF_STREAM, stop)
+
+
+def create_graph_from_string(val: str) -> None:
+    """Loads Kubernetes manifest from yaml formatted string input and constructs a Caboto graph. Extend the graph
+    running this function multiple times."""
+    for doc in _load_documents(val):
+        create_graph_from_dict(doc)
+
+
+def create_graph_from_stream(stream: IO) -> None:
+    """Loads Kubernetes manifests from a yaml formatted text stream (e.g. stdin or a pipe) and extends the Caboto graph
+    with every document as soon as it is read, without waiting for the end of the stream."""
+    for doc in _load_documents(stream):
+        create_graph_from_dict(doc)
+
+
+def create_graph_from_streams(streams: List[IO]) -> None:
+    """Loads Kubernetes manifests from multiple yaml formatted text streams concurrently (e.g. the stdout pipes of
+    several 'helm template' processes). Each stream is read in its own thread while the Caboto graph is extended with
+    the parsed documents in the calling thread."""
+    documents = Queue(maxsize=STREAM_BUFFER_SIZE)
+    stop = Event()
+    for stream in streams:
+        Thread(target=_read_documents, args=(stream, documents, stop), daemon=True).start()
+    pending = len(streams)
+    try:
+        while pending:
+            doc = documents.get()
+            if doc is _END_OF_STREAM:
+                pending -= 1
+            elif isinstance(doc, Exception):
+                raise doc
+            else:
+                create_graph_from_dict(doc)
+    finally:
+        # let the remaining readers terminate instead of blocking on the full queue
+        stop.set()
 
 
 def create_graph_from_path(path: Path) -> None:
@@ -54,14 +172,7 @@ def create_graph_from_path(path: Path) -> None:
     Caboto graph data structure."""
     for p in path.rglob("*.yaml"):
         with open(p.absolute(), "r") as stream:
-            try:
-                file = yaml.safe_load_all(stream)
-            except yaml.YAMLError as exc:
-                print(exc)
-                raise exc
-            else:
-                for doc in file:
-                    create_graph_from_dict(doc)
+            create_graph_from_stream(stream)
 
 
 @caboto_graph_required
@@ -70,9 +181,31 @@ def discover_relations(excluded_relations: List = []) -> None:
     CABOTO_GRAPH.discover_relations(exclude_relations=excluded_relations)
 
 
+def set_annotation_rules(**rules) -> None:
+    """Sets the rules for annotations added to the Caboto graph: 'skip_prefixes', 'truncate_prefixes',
+    'truncate_length' and 'max_value_length'. Run this function before discover_relations(...)."""
+    unknown = set(rules.keys()) - set(ANNOTATION_RULES.keys())
+    if unknown:
+        raise ValueError(f"The following annotation rules are unknown: {list(unknown)}")
+    for rule in ("skip_prefixes", "truncate_prefixes"):
+        if rule in rules and not (
+            isinstance(rules[rule], (list, tuple)) and all(isinstance(prefix, str) for prefix in rules[rule])
+        ):
+            raise ValueError(f"The annotation rule {rule} must be a list of key prefixes")
+    for rule in ("truncate_length", "max_value_length"):
+        # only the maximum value length can be None, which keeps all values
+        if rule not in rules or rule == "max_value_length" and rules[rule] is None:
+            continue
+        if type(rules[rule]) != int or rules[rule] < 0:
+            raise ValueError(f"The annotation rule {rule} must be a non-negative number of characters")
+    ANNOTATION_RULES.update(rules)
+
+
 @caboto_graph_required
 def plot_graph(excluded_types: List = []) -> None:
     """Plot the Caboto graph with predefined settings using matplotlib."""
+    if isinstance(CABOTO_GRAPH, SQLiteCabotoGraph):
+        raise ValueError("A Caboto graph stored in SQLite cannot be plotted.")
     draw_graph(CABOTO_GRAPH, excluded_types)
 
 
@@ -80,146 +213,223 @@ def plot_graph(excluded_types: List = []) -> None:
 # Functions to investigate the Caboto graph
 #
 
+# the default number of items returned by get_page(...)
+DEFAULT_PAGE_SIZE = 50
+
+
+def _iter_nodes_(_type: str, after: str = None) -> Iterator[Tuple[str, dict]]:
+    """Yields all nodes of a type sorted by their node ID, starting after the cursor node ID if given."""
+    for node in CABOTO_GRAPH.nodes_of_type(_type, after):
+        yield node, CABOTO_GRAPH.nodes[node]
+
+
+def _paginate_(items: Iterator, limit: int = None, offset: int = 0) -> Iterator:
+    offset = int(offset)
+    return islice(items, offset, offset + int(limit) if limit is not None else None)
+
+
+def _applications_(flat: bool = False, after: str = None) -> Iterator[Tuple[str, Any]]:
+    for appnode, data in _iter_nodes_("Application", after):
+        if flat:
+            yield appnode, data["data"].key
+        else:
+            yield appnode, (data["data"].key, [edge[1] for edge in CABOTO_GRAPH.out_edges(appnode)])
+
+
+def _containerimages_(flat: bool = False, after: str = None) -> Iterator[Tuple[str, Any]]:
+    for imgnode, data in _iter_nodes_("ContainerImage", after):
+        if flat:
+            yield imgnode, data["data"].key
+        else:
+            yield imgnode, (data["data"].key, [edge[0] for edge in CABOTO_GRAPH.in_edges(imgnode)])
+
+
+def _services_(flat: bool = False, after: str = None) -> Iterator[Tuple[str, Any]]:
+    for snode, data in _iter_nodes_("Service", after):
+        if flat:
+            # the node ID of a resource is '<kind>:<name>', its manifest need not be loaded for the name
+            yield snode, snode.split(":", 1)[1]
+        else:
+            yield snode, (snode, _service_pods_(snode))
+
+
+def _configmaps_(flat: bool = False, after: str = None) -> Iterator[Tuple[str, Any]]:
+    for cmnode, data in _iter_nodes_("ConfigMap", after):
+        if flat:
+            yield cmnode, cmnode
+        elif data["data"].specs.data:
+            yield cmnode, (cmnode, list(data["data"].specs.data.keys()))
+
+
+def _secrets_(flat: bool = False, after: str = None) -> Iterator[Tuple[str, Any]]:
+    for snode, data in _iter_nodes_("Secret", after):
+        if flat:
+            yield snode, snode
+        elif data["data"].specs.data:
+            yield snode, (snode, list(data["data"].specs.data.keys()))
+
+
+def _ingress_(flat: bool = False, after: str = None) -> Iterator[Tuple[str, Any]]:
+    for inode, _ in _iter_nodes_("Ingress", after):
+        if flat:
+            yield inode, inode
+        else:
+            yield inode, (
+                inode,
+                [(snode, _service_pods_(snode)) for snode in CABOTO_GRAPH.predecessors_of_type(inode, "Service")],
+            )
+
+
+def _hosts_(flat: bool = False, after: str = None) -> Iterator[Tuple[str, Any]]:
+    if flat:
+        # all hosts which are served by at least one ingress
+        for hnode, _ in _iter_nodes_("Host", after):
+            if CABOTO_GRAPH.predecessors_of_type(hnode, "Ingress"):
+                yield hnode, hnode
+    else:
+        for inode, _ in _iter_nodes_("Ingress", after):
+            yield inode, (
+                CABOTO_GRAPH.successors_of_type(inode, "Host"),
+                inode,
+            )
+
 
-def _filter_nodes_(_type: str):
-    return [(node, data) for node, data in CABOTO_GRAPH.nodes(data=True) if data["type"] == _type]
+# the item generators of all list functions that support pagination
+PAGEABLE = {
+    "list_applications": _applications_,
+    "list_containerimages": _containerimages_,
+    "list_services": _services_,
+    "list_configmaps": _configmaps_,
+    "list_secrets": _secrets_,
+    "list_ingress": _ingress_,
+    "list_hosts": _hosts_,
+}
 
 
 @caboto_graph_required
+def get_page(function: str, limit: int = DEFAULT_PAGE_SIZE, offset: int = 0, cursor: str = None, **kwargs) -> dict:
+    """Returns one page of the results of a list function, sorted by node ID. Pass the returned cursor to get the
+    next page, it is None on the last page. A limit of None returns all remaining results."""
+    if function not in PAGEABLE:
+        raise ValueError(f"The function {function} does not support pagination, use one of {list(PAGEABLE.keys())}")
+    page = list(_paginate_(PAGEABLE[function](after=cursor, **kwargs), limit, offset))
+    return {
+        "items": [item for _, item in page],
+        "cursor": page[-1][0] if page and limit is not None and len(page) == int(limit) else None,
+    }
+
+
+@caboto_graph_required
+def iter_applications(flat: bool = False, limit: int = None, offset: int = 0, cursor: str = None) -> Iterator:
+    """Iterate all applications and all related Kubernetes objects"""
+    return (item for _, item in _paginate_(_applications_(flat, cursor), limit, offset))
+
+
+@caboto_graph_required
+@caboto_cached
 def list_applications(flat: bool = False) -> List:
     """List all applications and all related Kubernetes objects"""
+    return list(iter_applications(flat))
 
-    nodes = _filter_nodes_("Application")
-    if flat:
-        applications = [data["data"].key for node, data in nodes]
-    else:
-        applications = []
-        for appnode, data in dict(nodes).items():
-            applications.append((data["data"].key, [edge[1] for edge in CABOTO_GRAPH.out_edges(appnode)]))
-    return applications
+
+@caboto_graph_required
+def iter_containerimages(flat: bool = False, limit: int = None, offset: int = 0, cursor: str = None) -> Iterator:
+    """Iterate all container images and the Pods running them"""
+    return (item for _, item in _paginate_(_containerimages_(flat, cursor), limit, offset))
 
 
 @caboto_graph_required
+@caboto_cached
 def list_containerimages(flat: bool = False) -> List:
     """List all container images and the Pods running them"""
+    return list(iter_containerimages(flat))
 
-    nodes = _filter_nodes_("ContainerImage")
-    if flat:
-        images = [data["data"].key for node, data in nodes]
-    else:
-        images = []
-        for imgnodes, data in dict(nodes).items():
-            images.append((data["data"].key, [edge[0] for edge in CABOTO_GRAPH.in_edges(imgnodes)]))
-    return images
+
+@caboto_graph_required
+def iter_services(flat: bool = False, limit: int = None, offset: int = 0, cursor: str = None) -> Iterator:
+    """Iterate all service names and their serving Pod nodes"""
+    return (item for _, item in _paginate_(_services_(flat, cursor), limit, offset))
 
 
 @caboto_graph_required
+@caboto_cached
 def list_services(flat: bool = False) -> List:
     """List all service names and their serving Pod nodes"""
-    nodes = _filter_nodes_("Service")
-    if flat:
-        services = [data["data"].name for node, data in nodes]
-    else:
-        services = []
-        for pnode, data in dict(nodes).items():
-            services.append(
-                (
-                    pnode,
-                    [edge[1] for edge in CABOTO_GRAPH.out_edges(pnode) if CABOTO_GRAPH.nodes[edge[1]]["type"] == "Pod"],
-                )
-            )
-    return services
+    return list(iter_services(flat))
+
+
+def _service_pods_(service: str) -> List:
+    # not memoized, the list functions call this for every service and would evict their own results from the cache
+    if service not in CABOTO_GRAPH.nodes:
+        return None
+    return CABOTO_GRAPH.successors_of_type(service, "Pod")
 
 
 @caboto_graph_required
+@caboto_cached
 def get_service_pods(service: str = None) -> List:
     """List all serving Pod for a service"""
     if service:
-        try:
-            CABOTO_GRAPH.nodes[service]
-        except KeyError:
-            return None
-        pods = [edge[1] for edge in CABOTO_GRAPH.out_edges(service) if CABOTO_GRAPH.nodes[edge[1]]["type"] == "Pod"]
-        return pods
+        return _service_pods_(service)
+
+
+@caboto_graph_required
+def iter_configmaps(flat: bool = False, limit: int = None, offset: int = 0, cursor: str = None) -> Iterator:
+    """Iterate all configmaps and their keys"""
+    return (item for _, item in _paginate_(_configmaps_(flat, cursor), limit, offset))
 
 
 @caboto_graph_required
+@caboto_cached
 def list_configmaps(flat: bool = False) -> List:
     """List all configmaps and their keys"""
-    nodes = _filter_nodes_("ConfigMap")
-    if flat:
-        cm = [node[0] for node in nodes]
-    else:
-        cm = [(node[0], list(node[1]["data"].specs.data.keys())) for node in nodes if node[1]["data"].specs.data]
-    return cm
+    return list(iter_configmaps(flat))
+
+
+@caboto_graph_required
+def iter_secrets(flat: bool = False, limit: int = None, offset: int = 0, cursor: str = None) -> Iterator:
+    """Iterate all secrets and their keys"""
+    return (item for _, item in _paginate_(_secrets_(flat, cursor), limit, offset))
 
 
 @caboto_graph_required
+@caboto_cached
 def list_secrets(flat: bool = False) -> List:
     """List all secrets and their keys"""
-    nodes = _filter_nodes_("Secret")
-    if flat:
-        secrets = [node[0] for node in nodes]
-    else:
-        secrets = [(node[0], list(node[1]["data"].specs.data.keys())) for node in nodes if node[1]["data"].specs.data]
-    return secrets
+    return list(iter_secrets(flat))
 
 
 @caboto_graph_required
+def iter_ingress(flat: bool = False, limit: int = None, offset: int = 0, cursor: str = None) -> Iterator:
+    """Iterate all ingress and their serving services and pods"""
+    return (item for _, item in _paginate_(_ingress_(flat, cursor), limit, offset))
+
+
+@caboto_graph_required
+@caboto_cached
 def list_ingress(flat: bool = False) -> List:
     """List all ingress and their serving services and pods"""
-    nodes = _filter_nodes_("Ingress")
-    if flat:
-        ingresss = [node[0] for node in nodes]
-    else:
-        ingresss = []
-        for inode, data in dict(nodes).items():
-            ingresss.append(
-                (
-                    inode,
-                    [
-                        (edge[0], get_service_pods(edge[0]))
-                        for edge in CABOTO_GRAPH.in_edges(inode)
-                        if CABOTO_GRAPH.nodes[edge[0]]["type"] == "Service"
-                    ],
-                )
-            )
-    return ingresss
+    return list(iter_ingress(flat))
 
 
 @caboto_graph_required
+def iter_hosts(flat: bool = False, limit: int = None, offset: int = 0, cursor: str = None) -> Iterator:
+    """Iterate all hosts and the ingress serving them"""
+    return (item for _, item in _paginate_(_hosts_(flat, cursor), limit, offset))
+
+
+@caboto_graph_required
+@caboto_cached
 def list_hosts(flat: bool = False) -> List:
     """List all hosts and the ingress serving them"""
-    nodes = _filter_nodes_("Ingress")
-
-    if flat:
-        hosts = set()
-        for inode, _ in dict(nodes).items():
-            hosts = hosts.union(
-                set(
-                    [edge[1] for edge in CABOTO_GRAPH.out_edges(inode) if CABOTO_GRAPH.nodes[edge[1]]["type"] == "Host"]
-                )
-            )
-    else:
-        hosts = []
-        for inode, data in dict(nodes).items():
-            hosts.append(
-                (
-                    [
-                        edge[1]
-                        for edge in CABOTO_GRAPH.out_edges(inode)
-                        if CABOTO_GRAPH.nodes[edge[1]]["type"] == "Host"
-                    ],
-                    inode,
-                )
-            )
-    return list(hosts)
+    return list(iter_hosts(flat))
 
 
 @caboto_graph_required
+@caboto_cached
 def sum_cpu_requests(default: str = "250m") -> str:
     """Returns the fractional amount of CPUs (normalized to 2 decimal places) requested across all Pods"""
-    pods = exec_query("AllPods")
+    pods = iter_query("AllPods")
     cpu_requests = []
     for pod in pods:
         pnode = CABOTO_GRAPH.nodes[pod]
@@ -234,9 +444,10 @@ def sum_cpu_requests(default: str = "250m") -> str:
 
 
 @caboto_graph_required
+@caboto_cached
 def sum_memory_requests(default: str = "128M", unit: str = "M") -> str:
     """Returns the amount of memory requested across all Pods. Defaults to MB as unit."""
-    pods = exec_query("AllPods")
+    pods = iter_query("AllPods")
     memory_requests = []
     for pod in pods:
         pnode = CABOTO_GRAPH.nodes[pod]
@@ -250,7 +461,41 @@ def sum_memory_requests(default: str = "128M", unit: str = "M") -> str:
     return f"{sum(memory_requests) / MEMORY_UNITS.get(unit):.2f}{unit}"
 
 
-def exec_query(query_name: str, **kwargs) -> list:
+@caboto_graph_required
+def memory_report() -> dict:
+    """Returns the memory retained by the Label and Annotation nodes of the Caboto graph and the savings of hashing
+    node IDs, interning keys and values and skipping or truncating annotations (in bytes)."""
+    kv_nodes = code_bytes = full_code_bytes = 0
+    # keys and values held by the nodes of an in-memory graph, interned strings are the same objects
+    strings = []
+    for _type in ("Label", "Annotation"):
+        for node in CABOTO_GRAPH.nodes_of_type(_type):
+            entity = CABOTO_GRAPH.nodes[node]["data"]
+            kv_nodes += 1
+            code_bytes += len(node)
+            full_code_bytes += len(f"{_type}:{entity.key}:") + entity.value_size
+            if isinstance(CABOTO_GRAPH, CabotoGraph):
+                strings.extend((entity.key, entity.value))
+    retained = {id(value): sys.getsizeof(value) for value in strings}
+    annotation_stats = CABOTO_GRAPH.graph.get(
+        "annotation_stats", {"skipped": 0, "skipped_bytes": 0, "truncated": 0, "truncated_bytes": 0}
+    )
+    return {
+        "kv_nodes": kv_nodes,
+        "node_id_bytes": code_bytes,
+        "node_id_saved_bytes": full_code_bytes - code_bytes,
+        "kv_string_bytes": sum(retained.values()),
+        "kv_string_saved_bytes": sum(sys.getsizeof(value) for value in strings) - sum(retained.values()),
+        "string_table_entries": len(string_table),
+        "string_table_bytes": string_table.size(),
+        "annotations_skipped": annotation_stats["skipped"],
+        "annotations_skipped_bytes": annotation_stats["skipped_bytes"],
+        "annotations_truncated": annotation_stats["truncated"],
+        "annotations_truncated_bytes": annotation_stats["truncated_bytes"],
+    }
+
+
+def _query_params_(query_name: str, **kwargs) -> dict:
     q = get_query(query_name)
     _qparams = q.get("params")
 
@@ -260,6 +505,18 @@ def exec_query(query_name: str, **kwargs) -> list:
                 _qparams = replace_query(_qparams, f"<{k}>", v)
         else:
             raise ValueError(f"The following arguments are missing: {list(set(_args) - set(kwargs.keys()))}")
+    return _qparams
+
+
+@caboto_graph_required
+def iter_query(query_name: str, limit: int = None, offset: int = 0, cursor=None, **kwargs) -> Iterator:
+    """Iterate the sorted results of a query from Caboto's query library, starting after the cursor result (a node
+    ID or an edge tuple) if given."""
+    return _paginate_(CABOTO_GRAPH.query(_query_params_(query_name, **kwargs), after=cursor), limit, offset)
 
-    result = run_query(CABOTO_GRAPH, _qparams)
+
+@caboto_graph_required
+@caboto_cached
+def exec_query(query_name: str, **kwargs) -> list:
+    result = list(CABOTO_GRAPH.query(_query_params_(query_name, **kwargs)))
     return result
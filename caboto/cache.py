@@ -0,0 +1,57 @@
+from collections import OrderedDict, namedtuple
+from copy import deepcopy
+from typing import Any, Callable, Hashable, Tuple
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "invalidations", "maxsize", "currsize"])
+
+DEFAULT_CACHE_SIZE = 128
+
+
+class GraphResultCache(object):
+    """A bounded LRU cache for results computed from a Caboto graph. All entries are bound to the graph version they
+    were computed with, once the graph changes the cache drops its entries automatically. Callers always get a copy
+    of the cached result, so that modifying it does not alter later results."""
+
+    def __init__(self, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._graph_key = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _sync(self, graph) -> None:
+        graph_key = (id(graph), graph.version)
+        if graph_key != self._graph_key:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+            self._graph_key = graph_key
+
+    def get_or_compute(self, graph, key: Tuple[Hashable, ...], func: Callable[[], Any]) -> Any:
+        self._sync(graph)
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return deepcopy(self._entries[key])
+        self.misses += 1
+        result = func()
+        # computing the result must not alter the graph, otherwise the result is not cacheable
+        if (id(graph), graph.version) == self._graph_key and self.maxsize > 0:
+            self._entries[key] = deepcopy(result)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    def resize(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        while len(self._entries) > max(maxsize, 0):
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._graph_key = None
+        self.hits = self.misses = self.invalidations = 0
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.invalidations, self.maxsize, len(self._entries))
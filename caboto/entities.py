@@ -1,8 +1,45 @@
+import hashlib
+import sys
+
 # global entities set in order to keep track of already created entities
 resource_entities = set()
 kv_entities = set()
 key_entities = set()
 
+# values of key-value entities longer than this are represented by their hash digest in the node ID
+KV_CODE_MAX_VALUE_LENGTH = 63
+KV_CODE_DIGEST_SIZE = 8
+
+
+class StringTable(object):
+    """A shared table of interned strings, equal keys and values of key-value entities are stored only once."""
+
+    def __init__(self):
+        self._strings = {}
+
+    def intern(self, value):
+        if not isinstance(value, str):
+            return value
+        return self._strings.setdefault(value, value)
+
+    def size(self) -> int:
+        return sum(sys.getsizeof(value) for value in self._strings)
+
+    def __len__(self):
+        return len(self._strings)
+
+
+# global string table for the keys and values of all key-value entities
+string_table = StringTable()
+
+
+def kv_code(type_name: str, key, value) -> str:
+    """Returns the node ID of a key-value entity, long values are represented by their hash digest."""
+    if len(str(value)) > KV_CODE_MAX_VALUE_LENGTH:
+        digest = hashlib.blake2b(str(value).encode(), digest_size=KV_CODE_DIGEST_SIZE).hexdigest()
+        return f"{type_name}:{key}:#{digest}"
+    return f"{type_name}:{key}:{value}"
+
 
 class K8sGraphEntity(object):
     registry = None
@@ -96,12 +133,17 @@ def EntityClassFactory(name, argnames, BaseClass=K8sResource):
 class KVEntity(K8sGraphEntity):
     registry = kv_entities
 
-    def __init__(self, key, value):
-        self.key = key
-        self.value = value
+    def __init__(self, key, value, max_length=None):
+        self.key = string_table.intern(key)
+        self.value_size = len(str(value))
+        # the node ID is derived from the full value, even if the stored value is truncated
+        self._code = kv_code(self.__class__.__name__, self.key, value)
+        if max_length is not None and isinstance(value, str) and len(value) > max_length:
+            value = value[:max_length]
+        self.value = string_table.intern(value)
 
     def _get_code(self):
-        return f"{self.__class__.__name__}:{self.key}:{self.value}"
+        return self._code
 
 
 class Label(KVEntity):
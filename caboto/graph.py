@@ -1,8 +1,11 @@
-from typing import List
+from bisect import bisect_right
+from functools import wraps
+from typing import Iterator, List
 
 import networkx as nx
 from entities import EntityClassFactory
 from relations import RELATIONS
+from utils import iter_query_results
 
 
 class K8sData(dict):
@@ -17,7 +20,24 @@ class K8sData(dict):
         return self.get(item)
 
 
+def _versioned(method):
+    # wrap a mutating DiGraph method so that every structural change bumps the graph version
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.version += 1
+        return result
+
+    return wrapper
+
+
 class CabotoGraph(nx.DiGraph):
+    # the version changes whenever nodes or edges are added or removed, it is used to invalidate cached results
+    version = 0
+    # node IDs sorted per type, rebuilt once the version changes
+    _type_index = None
+    _type_index_version = None
+
     def __init__(self, manifests: List[K8sData] = None, *args, **kwargs):
         super(CabotoGraph, self).__init__(*args, **kwargs)
         if manifests:
@@ -36,6 +56,47 @@ class CabotoGraph(nx.DiGraph):
             func = RELATIONS.get(relation)
             func(self)
 
+    def nodes_of_type(self, _type: str, after: str = None) -> Iterator[str]:
+        """Yields the IDs of all nodes of a type sorted by ID, starting after the cursor node ID if given."""
+        if self._type_index_version != self.version:
+            self._type_index = {}
+            for node, data in self.nodes(data=True):
+                self._type_index.setdefault(data.get("type"), []).append(node)
+            for nodes in self._type_index.values():
+                nodes.sort()
+            self._type_index_version = self.version
+        nodes = self._type_index.get(_type, [])
+        start = bisect_right(nodes, after) if after is not None else 0
+        return iter(nodes[start:])
+
+    def successors_of_type(self, node: str, _type: str) -> List[str]:
+        """Returns the targets of all edges from the node which are of the given type."""
+        return [edge[1] for edge in self.out_edges(node) if self.nodes[edge[1]].get("type") == _type]
+
+    def predecessors_of_type(self, node: str, _type: str) -> List[str]:
+        """Returns the sources of all edges to the node which are of the given type."""
+        return [edge[0] for edge in self.in_edges(node) if self.nodes[edge[0]].get("type") == _type]
+
+    def query(self, query_args: dict, after=None) -> Iterator:
+        """Runs a query from Caboto's query library on this graph and yields the sorted results, starting after the
+        cursor result (a node ID or an edge tuple) if given."""
+        results = sorted(iter_query_results(self, query_args))
+        if isinstance(after, list):
+            after = tuple(after)
+        start = bisect_right(results, after) if after is not None else 0
+        return iter(results[start:])
+
+    add_node = _versioned(nx.DiGraph.add_node)
+    add_nodes_from = _versioned(nx.DiGraph.add_nodes_from)
+    remove_node = _versioned(nx.DiGraph.remove_node)
+    remove_nodes_from = _versioned(nx.DiGraph.remove_nodes_from)
+    add_edge = _versioned(nx.DiGraph.add_edge)
+    add_edges_from = _versioned(nx.DiGraph.add_edges_from)
+    remove_edge = _versioned(nx.DiGraph.remove_edge)
+    remove_edges_from = _versioned(nx.DiGraph.remove_edges_from)
+    clear = _versioned(nx.DiGraph.clear)
+    clear_edges = _versioned(nx.DiGraph.clear_edges)
+
 
 def get_caboto_graph(manifests: List) -> CabotoGraph:
     """Create and returns a NetworkX DiGraph which contains all Kubernetes entities included"""
@@ -1,4 +1,13 @@
-from entities import Application, ContainerImage, Host, Label, Namespace
+from entities import Annotation, Application, ContainerImage, Host, Label, Namespace, kv_code
+
+# rules for annotations: keys with a skipped prefix are not added to the graph, values of keys with a truncated prefix
+# or longer than the maximum value length are truncated (a maximum value length of None keeps all values)
+ANNOTATION_RULES = {
+    "skip_prefixes": ["kubectl.kubernetes.io/last-applied-configuration", "checksum/"],
+    "truncate_prefixes": [],
+    "truncate_length": 64,
+    "max_value_length": 1024,
+}
 
 
 def set_namespace(graph):
@@ -17,12 +26,36 @@ def set_labels(graph):
                 graph.add_edge(lnode, node, label="labels")
 
 
+def should_skip_annotation(key) -> bool:
+    return key.startswith(tuple(ANNOTATION_RULES["skip_prefixes"]))
+
+
+def get_annotation_max_length(key):
+    if key.startswith(tuple(ANNOTATION_RULES["truncate_prefixes"])):
+        return ANNOTATION_RULES["truncate_length"]
+    return ANNOTATION_RULES["max_value_length"]
+
+
 def set_annotations(graph):
+    # skipped and truncated characters per annotation node, recorded for the memory report of this graph
+    skipped, truncated = {}, {}
     for node, data in list(graph.nodes.items()):
         if hasattr(data["data"], "annotations"):
-            for label in data["data"].annotations:
-                anode = Label(label[0], label[1]).add_as_node(graph)
+            for key, value in data["data"].annotations:
+                if should_skip_annotation(key):
+                    skipped[kv_code("Annotation", key, value)] = len(str(value))
+                    continue
+                max_length = get_annotation_max_length(key)
+                if max_length is not None and len(str(value)) > max_length:
+                    truncated[kv_code("Annotation", key, value)] = len(str(value)) - max_length
+                anode = Annotation(key, value, max_length=max_length).add_as_node(graph)
                 graph.add_edge(anode, node, label="annotates")
+    graph.graph["annotation_stats"] = {
+        "skipped": len(skipped),
+        "skipped_bytes": sum(skipped.values()),
+        "truncated": len(truncated),
+        "truncated_bytes": sum(truncated.values()),
+    }
 
 
 def set_selectors(graph):
@@ -0,0 +1,557 @@
+import json
+import sqlite3
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterator, List, Tuple, Union
+
+from entities import (
+    Annotation,
+    Application,
+    ContainerImage,
+    EntityClassFactory,
+    Host,
+    K8sResource,
+    KVEntity,
+    Label,
+    Namespace,
+    kv_code,
+)
+from graph import K8sData
+from relations import get_annotation_max_length, should_skip_annotation
+
+# the number of rows fetched at once when iterating nodes, keeps the memory bounded for large graphs
+FETCH_BATCH_SIZE = 1000
+# the number of inserted rows after which the pending transaction is committed
+COMMIT_BATCH_SIZE = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    id TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    name TEXT,
+    namespace TEXT,
+    key TEXT,
+    value TEXT,
+    data TEXT,
+    size INTEGER
+);
+CREATE INDEX IF NOT EXISTS nodes_type ON nodes (type, id);
+CREATE INDEX IF NOT EXISTS nodes_type_key_value ON nodes (type, key, value);
+
+CREATE TABLE IF NOT EXISTS attributes (
+    node TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT
+);
+CREATE INDEX IF NOT EXISTS attributes_kind_key_value ON attributes (kind, key, value);
+CREATE INDEX IF NOT EXISTS attributes_node ON attributes (node, kind);
+
+CREATE TABLE IF NOT EXISTS edges (
+    source TEXT NOT NULL,
+    target TEXT NOT NULL,
+    label TEXT,
+    data TEXT,
+    PRIMARY KEY (source, target)
+);
+CREATE INDEX IF NOT EXISTS edges_label ON edges (label);
+CREATE INDEX IF NOT EXISTS edges_target ON edges (target);
+"""
+
+KEY_ENTITIES = {"Application": Application, "ContainerImage": ContainerImage, "Host": Host}
+KV_ENTITIES = {"Label": Label, "Annotation": Annotation}
+
+# node and edge attributes of library queries and their columns
+NODE_COLUMNS = {"type": "type", ("data", "name"): "name", ("data", "key"): "key", ("data", "value"): "value"}
+EDGE_COLUMNS = {"label": "label"}
+
+
+#
+# Relations as set-based SQL, see relations.py for their in-memory counterparts
+#
+def set_namespace(graph):
+    graph.execute(
+        "INSERT OR IGNORE INTO nodes (id, type, name) SELECT DISTINCT 'Namespace:' || namespace, 'Namespace', namespace"
+        " FROM nodes WHERE data IS NOT NULL AND namespace IS NOT NULL"
+    )
+    graph.execute(
+        "INSERT OR REPLACE INTO edges (source, target, label) SELECT id, 'Namespace:' || namespace, 'in'"
+        " FROM nodes WHERE data IS NOT NULL AND namespace IS NOT NULL"
+    )
+
+
+def set_labels(graph):
+    graph.execute(
+        "INSERT OR IGNORE INTO nodes (id, type, key, value, size)"
+        " SELECT DISTINCT kv_code('Label', key, value), 'Label', key, value, length(value)"
+        " FROM attributes WHERE kind = 'label'"
+    )
+    graph.execute(
+        "INSERT OR REPLACE INTO edges (source, target, label) SELECT kv_code('Label', key, value), node, 'labels'"
+        " FROM attributes WHERE kind = 'label'"
+    )
+
+
+def set_annotations(graph):
+    annotations = (
+        "SELECT node, key, value, kv_code('Annotation', key, value) AS code, annotation_max_length(key) AS max_length"
+        " FROM attributes WHERE kind = 'annotation'"
+    )
+    skipped, skipped_bytes = graph.execute(
+        "SELECT COUNT(*), TOTAL(length(value)) FROM ("
+        f" SELECT DISTINCT code, value FROM ({annotations}) WHERE annotation_skipped(key)"
+        ")"
+    ).fetchone()
+    truncated, truncated_bytes = graph.execute(
+        "SELECT COUNT(*), TOTAL(length(value) - max_length) FROM ("
+        f" SELECT DISTINCT code, value, max_length FROM ({annotations})"
+        " WHERE NOT annotation_skipped(key) AND max_length IS NOT NULL AND length(value) > max_length"
+        ")"
+    ).fetchone()
+    graph.graph["annotation_stats"] = {
+        "skipped": skipped,
+        "skipped_bytes": int(skipped_bytes),
+        "truncated": truncated,
+        "truncated_bytes": int(truncated_bytes),
+    }
+    graph.execute(
+        "INSERT OR IGNORE INTO nodes (id, type, key, value, size) SELECT DISTINCT code, 'Annotation', key,"
+        " CASE WHEN max_length IS NULL THEN value ELSE substr(value, 1, max_length) END, length(value)"
+        f" FROM ({annotations}) WHERE NOT annotation_skipped(key)"
+    )
+    graph.execute(
+        "INSERT OR REPLACE INTO edges (source, target, label) SELECT code, node, 'annotates'"
+        f" FROM ({annotations}) WHERE NOT annotation_skipped(key)"
+    )
+
+
+def set_selectors(graph):
+    # a resource selects all Pods carrying every selector label that exists as a Label node in the graph
+    graph.execute(
+        "INSERT OR REPLACE INTO edges (source, target, label)"
+        " SELECT s.node, e.target, 'selects' FROM attributes s"
+        " JOIN nodes l ON l.type = 'Label' AND l.key = s.key AND l.value = s.value"
+        " JOIN edges e ON e.source = l.id"
+        " JOIN nodes p ON p.id = e.target AND p.type = 'Pod'"
+        " WHERE s.kind = 'selector'"
+        " GROUP BY s.node, e.target"
+        " HAVING COUNT(*) = ("
+        "  SELECT COUNT(*) FROM attributes s2"
+        "  JOIN nodes l2 ON l2.type = 'Label' AND l2.key = s2.key AND l2.value = s2.value"
+        "  WHERE s2.kind = 'selector' AND s2.node = s.node"
+        " )"
+    )
+
+
+def set_applications(graph):
+    # we get 'application' data from Kubernetes labels
+    graph.execute(
+        "INSERT OR IGNORE INTO nodes (id, type, key) SELECT DISTINCT 'Application:' || value, 'Application', value"
+        " FROM nodes WHERE type = 'Label' AND key = 'app.kubernetes.io/name'"
+    )
+    graph.execute(
+        "INSERT OR REPLACE INTO edges (source, target, label) SELECT 'Application:' || l.value, e.target, 'contains'"
+        " FROM nodes l JOIN edges e ON e.source = l.id WHERE l.type = 'Label' AND l.key = 'app.kubernetes.io/name'"
+    )
+
+
+def set_containerimages(graph):
+    containers = (
+        "SELECT p.id AS pod, json_extract(c.value, '$.image') AS image, c.value AS container"
+        " FROM nodes p, json_each(p.data, '$.spec.containers') c WHERE p.type = 'Pod'"
+    )
+    graph.execute(
+        "INSERT OR IGNORE INTO nodes (id, type, key) SELECT DISTINCT 'ContainerImage:' || image, 'ContainerImage',"
+        f" image FROM ({containers}) WHERE image IS NOT NULL"
+    )
+    graph.execute(
+        "INSERT OR REPLACE INTO edges (source, target, label, data) SELECT pod, 'ContainerImage:' || image, 'runs',"
+        " json_object('ports', CASE WHEN json_array_length(container, '$.ports') > 0 THEN json(("
+        "  SELECT json_group_object(json_extract(port.value, '$.name'), json_extract(port.value, '$.containerPort'))"
+        "  FROM json_each(container, '$.ports') port"
+        " )) END)"
+        f" FROM ({containers}) WHERE image IS NOT NULL"
+    )
+
+
+def set_ingressbackends(graph):
+    rules = (
+        "SELECT i.id AS ingress, json_extract(r.value, '$.host') AS host, r.value AS rule"
+        " FROM nodes i, json_each(i.data, '$.spec.rules') r WHERE i.type = 'Ingress'"
+    )
+    graph.execute(
+        f"INSERT OR IGNORE INTO nodes (id, type, key) SELECT DISTINCT 'Host:' || host, 'Host', host FROM ({rules})"
+        " WHERE host IS NOT NULL"
+    )
+    graph.execute(
+        f"INSERT OR REPLACE INTO edges (source, target, label) SELECT ingress, 'Host:' || host, 'hosts' FROM ({rules})"
+        " WHERE host IS NOT NULL"
+    )
+    graph.execute(
+        "INSERT OR REPLACE INTO edges (source, target, label, data)"
+        " SELECT s.id, r.ingress, 'serves', json_object('path', json_extract(p.value, '$.path'))"
+        f" FROM ({rules}) r, json_each(r.rule, '$.http.paths') p"
+        " JOIN nodes s ON s.id = 'Service:' || COALESCE("
+        "  json_extract(p.value, '$.backend.service.name'), json_extract(p.value, '$.backend.serviceName')"
+        " )"
+    )
+
+
+def set_container_port(graph):
+    # container ports are already stored with the 'runs' edges
+    pass
+
+
+SQL_RELATIONS = {
+    "namespace": set_namespace,
+    "labels": set_labels,
+    "annotations": set_annotations,
+    "selectors": set_selectors,
+    "applications": set_applications,
+    "containerimages": set_containerimages,
+    "ingressbackends": set_ingressbackends,
+    "containerport": set_container_port,
+}
+
+
+# node columns read for the node view, the manifest data is only loaded once the entity of a resource is accessed
+NODE_VIEW_COLUMNS = "id, type, name, namespace, key, value, data IS NOT NULL, size"
+
+
+class SQLiteNodeAttributes(Mapping):
+    """The attributes of a node in a SQLiteCabotoGraph, its entity is only reconstructed once it is accessed."""
+
+    def __init__(self, graph, row):
+        self._graph = graph
+        self._row = row
+        self._entity = None
+
+    def __getitem__(self, key):
+        if key == "type":
+            return self._row[1]
+        if key == "data":
+            if self._entity is None:
+                self._entity = self._graph.get_entity(self._row)
+            return self._entity
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("type", "data"))
+
+    def __len__(self):
+        return 2
+
+
+class SQLiteNodeView(object):
+    """A read-only view on the nodes of a SQLiteCabotoGraph which behaves like the NetworkX node view."""
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def __getitem__(self, node):
+        row = self._graph.execute(f"SELECT {NODE_VIEW_COLUMNS} FROM nodes WHERE id = ?", (node,)).fetchone()
+        if row is None:
+            raise KeyError(node)
+        return SQLiteNodeAttributes(self._graph, row)
+
+    def __contains__(self, node):
+        return self._graph.execute("SELECT 1 FROM nodes WHERE id = ?", (node,)).fetchone() is not None
+
+    def __len__(self):
+        return self._graph.number_of_nodes()
+
+    def __iter__(self):
+        return (node for node, _ in self.items())
+
+    def __call__(self, data=False):
+        return self.items() if data else iter(self)
+
+    def items(self) -> Iterator[Tuple[str, Mapping]]:
+        last = 0
+        while True:
+            rows = self._graph.execute(
+                f"SELECT rowid, {NODE_VIEW_COLUMNS} FROM nodes WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last, FETCH_BATCH_SIZE),
+            ).fetchall()
+            for row in rows:
+                yield row[1], SQLiteNodeAttributes(self._graph, row[1:])
+            if len(rows) < FETCH_BATCH_SIZE:
+                return
+            last = rows[-1][0]
+
+
+class SQLiteCabotoGraph(object):
+    """A Caboto graph which persists all nodes, attributes and edges in a SQLite database instead of memory. Relations
+    are discovered with set-based SQL and queries are translated to indexed lookups, so that the memory stays bounded
+    regardless of the size of the graph. The tables of an existing database are emptied, unless it is reopened to
+    continue with the stored graph."""
+
+    # the version changes whenever nodes or edges are added, it is used to invalidate cached results
+    version = 0
+
+    def __init__(self, database: Union[str, Path], manifests: List[K8sData] = None, reopen: bool = False):
+        self._db = sqlite3.connect(str(database))
+        self._db.executescript(SCHEMA)
+        if not reopen:
+            self._db.executescript("DELETE FROM nodes; DELETE FROM attributes; DELETE FROM edges;")
+        self._db.create_function("kv_code", 3, kv_code)
+        self._db.create_function("annotation_skipped", 1, should_skip_annotation)
+        self._db.create_function("annotation_max_length", 1, get_annotation_max_length)
+        self._pending = 0
+        # graph attributes like in NetworkX
+        self.graph = {}
+        self.nodes = SQLiteNodeView(self)
+        if manifests:
+            self.create_entities(manifests)
+
+    def __str__(self):
+        return f"{self.__class__.__name__} with {self.number_of_nodes()} nodes and {self.number_of_edges()} edges"
+
+    def execute(self, sql: str, parameters: tuple = ()) -> sqlite3.Cursor:
+        return self._db.execute(sql, parameters)
+
+    def commit(self) -> None:
+        self._db.commit()
+        self._pending = 0
+
+    def close(self) -> None:
+        self.commit()
+        self._db.close()
+
+    def _written(self, rows: int = 1) -> None:
+        self.version += 1
+        self._pending += rows
+        if self._pending >= COMMIT_BATCH_SIZE:
+            self.commit()
+
+    def create_entities(self, manifests: List[K8sData]):
+        for data in manifests:
+            resource_kind = data.kind
+            if data.kind is None:
+                raise ValueError("This file does not contain a valid Kubernetes manifest.")
+            AK8sResource = EntityClassFactory(resource_kind, [])
+            self._add_resource(AK8sResource(resource_kind, data))
+
+    def _add_resource(self, resource: K8sResource) -> None:
+        # Pods of workload resources are expanded like in K8sResource.add_as_node
+        if resource.specs.spec and resource.specs.spec.template:
+            replicas = resource.specs.spec.replicas or 1
+            pod_specification = resource.specs.spec.template
+            for i in range(1, replicas + 1):
+                pod_klass = EntityClassFactory("Pod", [])
+                pod_specification.metadata.name = f"{resource.name}-{i}"
+                self._add_resource(pod_klass("Pod", pod_specification))
+        self.add_node(resource._get_code(), type=resource.type, data=resource)
+
+    def add_node(self, node: str, **attr) -> None:
+        entity = attr.get("data")
+        columns = {"id": node, "type": attr.get("type")}
+        attributes = []
+        if isinstance(entity, K8sResource):
+            specs = entity.specs
+            columns.update(name=entity.name, namespace=specs.metadata.namespace, data=json.dumps(specs, default=str))
+            attributes.extend(("label", key, _text(value)) for key, value in entity.labels)
+            attributes.extend(("annotation", key, _text(value)) for key, value in entity.annotations)
+            if specs.spec and specs.spec.selector:
+                selectors = specs.spec.selector
+                if list(selectors.keys())[0] == "matchLabels":
+                    selectors = selectors["matchLabels"]
+                attributes.extend(("selector", key, _text(value)) for key, value in (selectors or {}).items())
+        elif isinstance(entity, KVEntity):
+            columns.update(key=entity.key, value=_text(entity.value), size=entity.value_size)
+        elif isinstance(entity, Namespace):
+            columns.update(name=entity.name)
+        elif entity is not None:
+            columns.update(key=entity.key)
+        self.execute(
+            f"INSERT OR REPLACE INTO nodes ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            tuple(columns.values()),
+        )
+        self.execute("DELETE FROM attributes WHERE node = ?", (node,))
+        self._db.executemany(
+            "INSERT INTO attributes (node, kind, key, value) VALUES (?, ?, ?, ?)",
+            ((node, kind, key, value) for kind, key, value in attributes),
+        )
+        self._written(1 + len(attributes))
+
+    def add_edge(self, u: str, v: str, label: str = None, **attr) -> None:
+        self.execute(
+            "INSERT OR REPLACE INTO edges (source, target, label, data) VALUES (?, ?, ?, ?)",
+            (u, v, label, json.dumps(attr) if attr else None),
+        )
+        self._written()
+
+    def get_entity(self, row: tuple):
+        """Reconstructs the Caboto entity of a node view row."""
+        node, _type, name, namespace, key, value, is_resource, size = row
+        if is_resource:
+            (data,) = self.execute("SELECT data FROM nodes WHERE id = ?", (node,)).fetchone()
+            return EntityClassFactory(_type, [])(_type, K8sData(**json.loads(data)))
+        if _type in KV_ENTITIES:
+            entity = KV_ENTITIES[_type].__new__(KV_ENTITIES[_type])
+            entity.__dict__.update(key=key, value=value, value_size=size or 0, _code=node)
+            return entity
+        if _type in KEY_ENTITIES:
+            return KEY_ENTITIES[_type](key)
+        return Namespace(name)
+
+    def number_of_nodes(self) -> int:
+        return self.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    def number_of_edges(self) -> int:
+        return self.execute("SELECT COUNT(*) FROM edges").fetchone()[0]
+
+    def _edges(self, column: str, node: str, data: bool) -> List:
+        rows = self.execute(f"SELECT source, target, label, data FROM edges WHERE {column} = ?", (node,)).fetchall()
+        if data:
+            return [(u, v, {"label": label, **json.loads(attr or "{}")}) for u, v, label, attr in rows]
+        return [(u, v) for u, v, _, _ in rows]
+
+    def _neighbors_of_type(self, column: str, other: str, node: str, _type: str) -> List[str]:
+        return [
+            row[0]
+            for row in self.execute(
+                f"SELECT e.{other} FROM edges e JOIN nodes n ON n.id = e.{other}"
+                f" WHERE e.{column} = ? AND n.type = ? ORDER BY e.{other}",
+                (node, _type),
+            )
+        ]
+
+    def successors_of_type(self, node: str, _type: str) -> List[str]:
+        """Returns the targets of all edges from the node which are of the given type."""
+        return self._neighbors_of_type("source", "target", node, _type)
+
+    def predecessors_of_type(self, node: str, _type: str) -> List[str]:
+        """Returns the sources of all edges to the node which are of the given type."""
+        return self._neighbors_of_type("target", "source", node, _type)
+
+    def out_edges(self, node: str, data: bool = False) -> List:
+        return self._edges("source", node, data)
+
+    def in_edges(self, node: str, data: bool = False) -> List:
+        return self._edges("target", node, data)
+
+    def discover_relations(self, exclude_relations=[]):
+        for relation in list(filter(lambda x: x not in exclude_relations, SQL_RELATIONS.keys())):
+            func = SQL_RELATIONS.get(relation)
+            func(self)
+            self.version += 1
+        self.commit()
+
+    def nodes_of_type(self, _type: str, after: str = None) -> Iterator[str]:
+        """Yields the IDs of all nodes of a type sorted by ID, starting after the cursor node ID if given."""
+        last = after if after is not None else ""
+        while True:
+            rows = self.execute(
+                "SELECT id FROM nodes WHERE type = ? AND id > ? ORDER BY id LIMIT ?", (_type, last, FETCH_BATCH_SIZE)
+            ).fetchall()
+            for row in rows:
+                yield row[0]
+            if len(rows) < FETCH_BATCH_SIZE:
+                return
+            last = rows[-1][0]
+
+    def query(self, query_args: dict, after=None) -> Iterator:
+        """Translates a query from Caboto's query library to SQL and yields the sorted results lazily, starting after
+        the cursor result (a node ID or an edge tuple) if given. Subqueries restrict the result to the edges adjacent
+        to their result nodes."""
+        sql, params = _translate_query(query_args)
+        flatten = query_args.get("flatten")
+        if type(flatten) == int:
+            columns = [f"c{flatten}"]
+        elif query_args["func"] == "search_nodes":
+            columns = ["c0"]
+        else:
+            columns = ["c0", "c1"]
+        sql = f"SELECT {', '.join(columns)} FROM ({sql})"
+        if after is not None:
+            after = list(after) if isinstance(after, (list, tuple)) else [after]
+            sql += f" WHERE ({', '.join(columns)}) > ({', '.join('?' * len(columns))})"
+            params = params + after
+        for row in self.execute(f"{sql} ORDER BY {', '.join(columns)}", params):
+            yield row[0] if len(row) == 1 else tuple(row)
+
+
+def _text(value):
+    return str(value) if value is not None else None
+
+
+def _translate_condition(query: dict, alias: str, columns: dict) -> Tuple[str, list]:
+    """Translates a networkx-query constraint to a SQL condition on the columns of a table alias."""
+    if not query:
+        return "1", []
+    (operator, operands), *rest = query.items()
+    if rest:
+        raise ValueError(f"The query {query} must have exactly one operator")
+    if operator in ("and", "&&", "or", "||"):
+        conditions = [_translate_condition(operand, alias, columns) for operand in operands]
+        junction = " AND " if operator in ("and", "&&") else " OR "
+        return f"({junction.join(c for c, _ in conditions)})", [p for _, params in conditions for p in params]
+    if operator in ("not", "!"):
+        operand = operands[0] if isinstance(operands, list) else operands
+        condition, params = _translate_condition(operand, alias, columns)
+        return f"NOT {condition}", params
+    path = tuple(operands[0]) if isinstance(operands[0], (list, tuple)) else operands[0]
+    if path not in columns:
+        raise ValueError(f"The query path {path} cannot be translated to SQL, use one of {list(columns.keys())}")
+    column = f"{alias}.{columns[path]}"
+    if operator in ("eq", "=="):
+        return f"{column} = ?", [operands[1]]
+    if operator in ("neq", "!="):
+        return f"{column} IS NOT ?", [operands[1]]
+    if operator in ("in", ":="):
+        return f"{column} IN ({', '.join('?' * len(operands[1]))})", list(operands[1])
+    if operator == "has":
+        return f"{column} IS NOT NULL", []
+    raise ValueError(f"The query operator {operator} cannot be translated to SQL")
+
+
+def _translate_query(query_args: dict) -> Tuple[str, list]:
+    """Translates a query from Caboto's query library to a SQL select statement and its parameters."""
+    params = []
+    subqueries = []
+    constraints = {}
+    for end in ("source", "target"):
+        if end in query_args and query_args[end].get("subquery"):
+            subquery = query_args[end]["subquery"]
+            if type(subquery.get("flatten")) != int and subquery["func"] != "search_nodes":
+                raise ValueError("A subquery must return a list of graph nodes, please use the 'flatten' keyword")
+            sql, sub_params = _translate_query(subquery)
+            subqueries.append(f"SELECT c{subquery.get('flatten') or 0} FROM ({sql})")
+            params.extend(sub_params)
+        else:
+            constraints[end] = query_args.get(end)
+    adjacent = " UNION ".join(subqueries)
+
+    func = query_args["func"]
+    if func == "search_nodes":
+        condition, condition_params = _translate_condition(query_args.get("query"), "n", NODE_COLUMNS)
+        sql = f"SELECT n.id AS c0 FROM nodes n WHERE {condition}"
+        if adjacent:
+            sql += (
+                f" AND n.id IN (SELECT target FROM edges WHERE source IN ({adjacent})"
+                f" UNION SELECT source FROM edges WHERE target IN ({adjacent}))"
+            )
+            params = params * 2
+        return sql + " ORDER BY n.rowid", condition_params + params
+    if func == "search_edges":
+        condition, condition_params = _translate_condition(query_args.get("query"), "e", EDGE_COLUMNS)
+        sql = f"SELECT e.source AS c0, e.target AS c1 FROM edges e WHERE {condition}"
+    elif func == "search_direct_relationships":
+        conditions = [
+            _translate_condition(query_args.get("edge"), "e", EDGE_COLUMNS),
+            _translate_condition(constraints.get("source"), "s", NODE_COLUMNS),
+            _translate_condition(constraints.get("target"), "t", NODE_COLUMNS),
+        ]
+        condition = " AND ".join(c for c, _ in conditions)
+        condition_params = [p for _, c_params in conditions for p in c_params]
+        sql = (
+            "SELECT e.source AS c0, e.target AS c1 FROM edges e JOIN nodes s ON s.id = e.source"
+            f" JOIN nodes t ON t.id = e.target WHERE {condition}"
+        )
+    else:
+        raise ValueError(f"The query function {func} cannot be translated to SQL")
+    if adjacent:
+        sql += f" AND (e.source IN ({adjacent}) OR e.target IN ({adjacent}))"
+        params = params * 2
+    return sql + " ORDER BY e.rowid", condition_params + params
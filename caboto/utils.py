@@ -2,7 +2,7 @@ import ast
 import os
 import pathlib
 import re
-from typing import List
+from typing import Iterator, List
 
 import networkx as nx
 import networkx_query
@@ -59,6 +59,11 @@ def get_sub_graph(graph, subgraph, node):
 
 
 def run_query(graph, query_args) -> List:
+    return list(iter_query_results(graph, query_args))
+
+
+def iter_query_results(graph, query_args) -> Iterator:
+    """Runs a query and yields its results lazily, only subqueries are evaluated upfront"""
     source_graph = graph
     subgraph = nx.DiGraph()
     if "source" in query_args and query_args["source"].get("subquery"):
@@ -85,7 +90,5 @@ def run_query(graph, query_args) -> List:
     query_args.update({"graph": source_graph})
     result = _func(**query_args)
     if type(flatten) == int:
-        result = [_i[flatten] for _i in result]
-    else:
-        result = list(result)
+        result = (_i[flatten] for _i in result)
     return result